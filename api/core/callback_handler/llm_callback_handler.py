@@ -17,6 +17,12 @@ from core.model_providers.models.llm.base import BaseLLM
 from core.moderation.base import ModerationOutputsResult, ModerationAction
 from core.moderation.factory import ModerationFactory
 
+# langchain message type -> role saved with the prompt, anything else is saved as system
+MESSAGE_TYPE_ROLES = {
+    'human': 'user',
+    'ai': 'assistant'
+}
+
 
 class ModerationRule(BaseModel):
     type: str
@@ -30,6 +36,7 @@ class LLMCallbackHandler(BaseCallbackHandler):
                  conversation_message_task: ConversationMessageTask):
         self.model_instance = model_instance
         self.llm_message = LLMMessage()
+        self.completion_chunks: List[str] = []
         self.start_at = None
         self.conversation_message_task = conversation_message_task
 
@@ -64,21 +71,18 @@ class LLMCallbackHandler(BaseCallbackHandler):
     ) -> Any:
         real_prompts = []
         for message in messages[0]:
-            if message.type == 'human':
-                role = 'user'
-            elif message.type == 'ai':
-                role = 'assistant'
-            else:
-                role = 'system'
-
-            real_prompts.append({
-                "role": role,
-                "text": message.content,
-                "files": [{
+            files = []
+            if isinstance(message, LCHumanMessageWithFiles):
+                files = [{
                     "type": file.type.value,
                     "data": file.data[:10] + '...[TRUNCATED]...' + file.data[-10:],
                     "detail": file.detail.value if isinstance(file, ImagePromptMessageFile) else None,
-                } for file in (message.files if isinstance(message, LCHumanMessageWithFiles) else [])]
+                } for file in message.files]
+
+            real_prompts.append({
+                "role": MESSAGE_TYPE_ROLES.get(message.type, 'system'),
+                "text": message.content,
+                "files": files
             })
 
         self.llm_message.prompt = real_prompts
@@ -132,7 +136,8 @@ class LLMCallbackHandler(BaseCallbackHandler):
 
         try:
             self.conversation_message_task.append_message_text(token)
-            self.llm_message.completion += token
+            # joined once when the stream is interrupted, avoids re-copying the completion on every token
+            self.completion_chunks.append(token)
 
             if self.output_moderation_handler:
                 self.output_moderation_handler.append_new_token(token)
@@ -149,6 +154,7 @@ class LLMCallbackHandler(BaseCallbackHandler):
 
         if isinstance(error, ConversationTaskStoppedException):
             if self.conversation_message_task.streaming:
+                self.llm_message.completion = ''.join(self.completion_chunks)
                 self.llm_message.completion_tokens = self.model_instance.get_num_tokens(
                     [PromptMessage(content=self.llm_message.completion)]
                 )
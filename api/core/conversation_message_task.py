@@ -2,6 +2,8 @@ import json
 import time
 from typing import Optional, Union, List
 
+import orjson
+
 from core.callback_handler.entity.agent_loop import AgentLoop
 from core.callback_handler.entity.dataset_query import DatasetQueryObj
 from core.callback_handler.entity.llm_message import LLMMessage
@@ -15,6 +17,7 @@ from core.prompt.prompt_template import PromptTemplateParser
 from events.message_event import message_was_created
 from extensions.ext_database import db
 from extensions.ext_redis import redis_client
+from libs.helper import json_dumps_bytes
 from models.dataset import DatasetQuery
 from models.model import AppModelConfig, Conversation, Account, Message, EndUser, App, MessageAgentThought, \
     MessageChain, DatasetRetrieverResource, MessageFile
@@ -25,7 +28,7 @@ class ConversationMessageTask:
                  inputs: dict, query: str, files: List[FileObj], streaming: bool,
                  model_instance: BaseLLM, conversation: Optional[Conversation] = None, is_override: bool = False,
                  auto_generate_name: bool = True):
-        self.start_at = time.perf_counter()
+        self.start_at_ns = time.monotonic_ns()
 
         self.task_id = task_id
 
@@ -185,20 +188,23 @@ class ConversationMessageTask:
         self.message.answer_tokens = answer_tokens
         self.message.answer_unit_price = answer_unit_price
         self.message.answer_price_unit = answer_price_unit
-        self.message.provider_response_latency = time.perf_counter() - self.start_at
+        self.message.provider_response_latency = (time.monotonic_ns() - self.start_at_ns) / 1e9
         self.message.total_price = total_price
 
         db.session.commit()
 
-        message_was_created.send(
-            self.message,
-            conversation=self.conversation,
-            is_first_message=self.is_new_conversation,
-            auto_generate_name=self.auto_generate_name
-        )
-
-        if not by_stopped:
-            self.end()
+        try:
+            if not by_stopped:
+                # the message is committed, so the client can be answered before the message_was_created
+                # handlers run, e.g. naming the conversation with another LLM call
+                self.end()
+        finally:
+            message_was_created.send(
+                self.message,
+                conversation=self.conversation,
+                is_first_message=self.is_new_conversation,
+                auto_generate_name=self.auto_generate_name
+            )
 
     def init_chain(self, chain_result: ChainResult):
         message_chain = MessageChain(
@@ -220,9 +226,10 @@ class ConversationMessageTask:
         self._pub_handler.pub_chain(message_chain)
 
     def on_agent_start(self, message_chain: MessageChain, agent_loop: AgentLoop) -> MessageAgentThought:
+        message_chain_id = message_chain.id
         message_agent_thought = MessageAgentThought(
             message_id=self.message.id,
-            message_chain_id=message_chain.id,
+            message_chain_id=message_chain_id,
             position=agent_loop.position,
             thought=agent_loop.thought,
             tool=agent_loop.tool_name,
@@ -236,9 +243,19 @@ class ConversationMessageTask:
         )
 
         db.session.add(message_agent_thought)
+        # read the generated id before commit expires the instance, so publishing doesn't reload the row
+        db.session.flush()
+        agent_thought_id = message_agent_thought.id
         db.session.commit()
 
-        self._pub_handler.pub_agent_thought(message_agent_thought)
+        self._pub_handler.pub_agent_thought(
+            agent_thought_id=agent_thought_id,
+            message_chain_id=message_chain_id,
+            position=agent_loop.position,
+            thought=agent_loop.thought,
+            tool=agent_loop.tool_name,
+            tool_input=agent_loop.tool_input
+        )
 
         return message_agent_thought
 
@@ -320,11 +337,22 @@ class ConversationMessageTask:
         self._pub_handler.pub_end()
 
     def annotation_end(self, text: str, annotation_id: str, annotation_author_name: str):
-        self._pub_handler.pub_annotation(text, annotation_id, annotation_author_name, self.start_at)
+        self._pub_handler.pub_annotation(text, annotation_id, annotation_author_name, self.start_at_ns)
         self._pub_handler.pub_end()
 
 
 class PubHandler:
+    # Events are published as {'event': ..., 'data': {...}}, except for `message` chunks, which carry
+    # their text at the top level: {'event': 'message', 'text': ..., 'data': <shared event data>}.
+    # The shared data is published without a copy per token, so it must never hold the text.
+    # CompletionService reads the chunk text from result['text'] in both streaming and blocking mode.
+
+    # streamed text tokens only look up the stop flag in redis once every N tokens
+    STOPPED_CHECK_INTERVAL = 10
+
+    # the ping payload never changes, so it is encoded once and shared by every channel
+    PING_CONTENT = orjson.dumps({'event': 'ping'})
+
     def __init__(self, user: Union[Account, EndUser], task_id: str,
                  message: Message, conversation: Conversation,
                  chain_pub: bool = False, agent_thought_pub: bool = False):
@@ -337,6 +365,17 @@ class PubHandler:
         self._chain_pub = chain_pub
         self._agent_thought_pub = agent_thought_pub
 
+        self._stopped = False
+        self._stopped_check_counter = 0
+
+        # fields shared by every streamed event of this message, resolved once instead of per token
+        self._event_data = {
+            'task_id': task_id,
+            'message_id': str(message.id),
+            'mode': conversation.mode,
+            'conversation_id': str(conversation.id)
+        }
+
     @classmethod
     def generate_channel_name(cls, user: Union[Account, EndUser], task_id: str):
         if not user:
@@ -351,36 +390,29 @@ class PubHandler:
         return "generate_result_stopped:{}-{}".format(user_str, task_id)
 
     def pub_text(self, text: str):
+        # the text stays at the top level so the shared event data needs no copy per token
         content = {
             'event': 'message',
-            'data': {
-                'task_id': self._task_id,
-                'message_id': str(self._message.id),
-                'text': text,
-                'mode': self._conversation.mode,
-                'conversation_id': str(self._conversation.id)
-            }
+            'text': text,
+            'data': self._event_data
         }
 
-        redis_client.publish(self._channel, json.dumps(content))
+        redis_client.publish(self._channel, json_dumps_bytes(content))
 
-        if self._is_stopped():
+        if self._is_stopped(throttled=True):
             self.pub_end()
             raise ConversationTaskStoppedException()
 
     def pub_message_replace(self, text: str):
+        data = self._event_data.copy()
+        data['text'] = text
+
         content = {
             'event': 'message_replace',
-            'data': {
-                'task_id': self._task_id,
-                'message_id': str(self._message.id),
-                'text': text,
-                'mode': self._conversation.mode,
-                'conversation_id': str(self._conversation.id)
-            }
+            'data': data
         }
 
-        redis_client.publish(self._channel, json.dumps(content))
+        redis_client.publish(self._channel, json_dumps_bytes(content))
 
         if self._is_stopped():
             self.pub_end()
@@ -402,31 +434,31 @@ class PubHandler:
                 }
             }
 
-            redis_client.publish(self._channel, json.dumps(content))
+            redis_client.publish(self._channel, json_dumps_bytes(content))
 
         if self._is_stopped():
             self.pub_end()
             raise ConversationTaskStoppedException()
 
-    def pub_agent_thought(self, message_agent_thought: MessageAgentThought):
+    def pub_agent_thought(self, agent_thought_id: str, message_chain_id: str, position: int,
+                          thought: Optional[str], tool: Optional[str], tool_input: Optional[str]):
         if self._agent_thought_pub:
+            data = self._event_data.copy()
+            data.update({
+                'id': agent_thought_id,
+                'chain_id': message_chain_id,
+                'position': position,
+                'thought': thought,
+                'tool': tool,
+                'tool_input': tool_input
+            })
+
             content = {
                 'event': 'agent_thought',
-                'data': {
-                    'id': message_agent_thought.id,
-                    'task_id': self._task_id,
-                    'message_id': self._message.id,
-                    'chain_id': message_agent_thought.message_chain_id,
-                    'position': message_agent_thought.position,
-                    'thought': message_agent_thought.thought,
-                    'tool': message_agent_thought.tool,
-                    'tool_input': message_agent_thought.tool_input,
-                    'mode': self._conversation.mode,
-                    'conversation_id': self._conversation.id
-                }
+                'data': data
             }
 
-            redis_client.publish(self._channel, json.dumps(content))
+            redis_client.publish(self._channel, json_dumps_bytes(content))
 
         if self._is_stopped():
             self.pub_end()
@@ -444,13 +476,13 @@ class PubHandler:
         }
         if retriever_resource:
             content['data']['retriever_resources'] = retriever_resource
-        redis_client.publish(self._channel, json.dumps(content))
+        redis_client.publish(self._channel, json_dumps_bytes(content))
 
         if self._is_stopped():
             self.pub_end()
             raise ConversationTaskStoppedException()
 
-    def pub_annotation(self, text: str, annotation_id: str, annotation_author_name: str, start_at: float):
+    def pub_annotation(self, text: str, annotation_id: str, annotation_author_name: str, start_at_ns: int):
         content = {
             'event': 'annotation',
             'data': {
@@ -464,11 +496,11 @@ class PubHandler:
             }
         }
         self._message.answer = text
-        self._message.provider_response_latency = time.perf_counter() - start_at
+        self._message.provider_response_latency = (time.monotonic_ns() - start_at_ns) / 1e9
 
         db.session.commit()
 
-        redis_client.publish(self._channel, json.dumps(content))
+        redis_client.publish(self._channel, json_dumps_bytes(content))
 
         if self._is_stopped():
             self.pub_end()
@@ -479,7 +511,7 @@ class PubHandler:
             'event': 'end',
         }
 
-        redis_client.publish(self._channel, json.dumps(content))
+        redis_client.publish(self._channel, json_dumps_bytes(content))
 
     @classmethod
     def pub_error(cls, user: Union[Account, EndUser], task_id: str, e):
@@ -489,23 +521,31 @@ class PubHandler:
         }
 
         channel = cls.generate_channel_name(user, task_id)
-        redis_client.publish(channel, json.dumps(content))
+        redis_client.publish(channel, json_dumps_bytes(content))
 
-    def _is_stopped(self):
-        return redis_client.get(self._stopped_cache_key) is not None
+    def _is_stopped(self, throttled: bool = False) -> bool:
+        if self._stopped:
+            return True
 
-    @classmethod
-    def ping(cls, user: Union[Account, EndUser], task_id: str):
-        content = {
-            'event': 'ping'
-        }
+        if throttled:
+            self._stopped_check_counter += 1
+            if self._stopped_check_counter < self.STOPPED_CHECK_INTERVAL:
+                return False
 
-        channel = cls.generate_channel_name(user, task_id)
-        redis_client.publish(channel, json.dumps(content))
+        self._stopped_check_counter = 0
+        self._stopped = redis_client.get(self._stopped_cache_key) is not None
+        return self._stopped
+
+    @classmethod
+    def ping(cls, channel: str):
+        redis_client.publish(channel, cls.PING_CONTENT)
 
     @classmethod
     def stop(cls, user: Union[Account, EndUser], task_id: str):
-        stopped_cache_key = cls.generate_stopped_cache_key(user, task_id)
+        cls.stop_by_cache_key(cls.generate_stopped_cache_key(user, task_id))
+
+    @classmethod
+    def stop_by_cache_key(cls, stopped_cache_key: str):
         redis_client.setex(stopped_cache_key, 600, 1)
 
 
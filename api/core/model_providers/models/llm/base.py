@@ -16,6 +16,12 @@ from core.third_party.langchain.llms.fake import FakeLLM
 
 logger = logging.getLogger(__name__)
 
+# Decimal is immutable, so the price constants are built once and shared by every model instance
+DECIMAL_ZERO = decimal.Decimal(0)
+TOTAL_PRICE_EXPONENT = decimal.Decimal('0.0000001')
+UNIT_PRICE_EXPONENT = decimal.Decimal('0.0001')
+PRICE_UNIT_EXPONENT = decimal.Decimal('0.000001')
+
 
 class BaseLLM(BaseProviderModel):
     model_mode: ModelMode = ModelMode.COMPLETION
@@ -78,9 +84,9 @@ class BaseLLM(BaseProviderModel):
     def price_config(self) -> dict:
         def get_or_default():
             default_price_config = {
-                'prompt': decimal.Decimal('0'),
-                'completion': decimal.Decimal('0'),
-                'unit': decimal.Decimal('0'),
+                'prompt': DECIMAL_ZERO,
+                'completion': DECIMAL_ZERO,
+                'unit': DECIMAL_ZERO,
                 'currency': 'USD'
             }
             rules = self.model_provider.get_rules()
@@ -229,7 +235,7 @@ class BaseLLM(BaseProviderModel):
         unit = self.get_price_unit(message_type)
 
         total_price = tokens * unit_price * unit
-        total_price = total_price.quantize(decimal.Decimal('0.0000001'), rounding=decimal.ROUND_HALF_UP)
+        total_price = total_price.quantize(TOTAL_PRICE_EXPONENT, rounding=decimal.ROUND_HALF_UP)
         logging.debug(f"tokens={tokens}, unit_price={unit_price}, unit={unit}, total_price:{total_price}")
         return total_price
 
@@ -244,7 +250,7 @@ class BaseLLM(BaseProviderModel):
             unit_price = self.price_config['prompt']
         else:
             unit_price = self.price_config['completion']
-        unit_price = unit_price.quantize(decimal.Decimal('0.0001'), rounding=decimal.ROUND_HALF_UP)
+        unit_price = unit_price.quantize(UNIT_PRICE_EXPONENT, rounding=decimal.ROUND_HALF_UP)
         logging.debug(f"unit_price={unit_price}")
         return unit_price
 
@@ -260,7 +266,7 @@ class BaseLLM(BaseProviderModel):
         else:
             price_unit = self.price_config['unit']
 
-        price_unit = price_unit.quantize(decimal.Decimal('0.000001'), rounding=decimal.ROUND_HALF_UP)
+        price_unit = price_unit.quantize(PRICE_UNIT_EXPONENT, rounding=decimal.ROUND_HALF_UP)
         logging.debug(f"price_unit={price_unit}")
         return price_unit
 
@@ -339,7 +345,9 @@ class BaseLLM(BaseProviderModel):
         :return:
         """
         model_kwargs_input = {}
-        for key, value in model_kwargs.dict().items():
+        # read the fields directly, the kwargs are flat so .dict()'s recursive copy buys nothing
+        for key in model_kwargs.__fields__:
+            value = getattr(model_kwargs, key)
             rule = getattr(model_rules, key)
             if not rule.enabled:
                 continue
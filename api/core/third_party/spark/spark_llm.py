@@ -52,7 +52,7 @@ class SparkLLMClient:
             api_secret
         )
 
-        self.queue = queue.Queue()
+        self.queue = queue.SimpleQueue()
         self.blocking_message = ''
 
     def create_url(self, host: str, path: str, api_base: str, api_key: str, api_secret: str) -> str:
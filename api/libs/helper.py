@@ -1,4 +1,5 @@
 # -*- coding:utf-8 -*-
+import json
 import re
 import subprocess
 import uuid
@@ -8,6 +9,7 @@ from zoneinfo import available_timezones
 import random
 import string
 
+import orjson
 from flask_restful import fields
 
 
@@ -153,3 +155,18 @@ def get_remote_ip(request):
 def generate_text_hash(text: str) -> str:
     hash_text = str(text) + 'None'
     return sha256(hash_text.encode()).hexdigest()
+
+
+def json_dumps_bytes(obj) -> bytes:
+    # orjson rejects lone surrogates (e.g. an emoji split across two streamed deltas), json escapes them
+    try:
+        return orjson.dumps(obj)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj).encode('utf-8')
+
+
+def json_loads_bytes(data: bytes):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
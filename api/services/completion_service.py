@@ -5,6 +5,7 @@ import time
 import uuid
 from typing import Generator, Union, Any, Optional, List
 
+import orjson
 from flask import current_app, Flask
 from redis.client import PubSub
 from sqlalchemy import and_
@@ -19,6 +20,7 @@ from core.model_providers.error import LLMBadRequestError, LLMAPIConnectionError
 from core.model_providers.models.entity.message import PromptMessageFile
 from extensions.ext_database import db
 from extensions.ext_redis import redis_client
+from libs.helper import json_dumps_bytes, json_loads_bytes
 from models.model import Conversation, AppModelConfig, App, Account, EndUser, Message
 from services.app_model_config_service import AppModelConfigService
 from services.errors.app import MoreLikeThisDisabledError
@@ -29,6 +31,15 @@ from services.errors.message import MessageNotExistsError
 
 
 class CompletionService:
+    # streamed message chunks arriving within this window are merged into a single SSE frame
+    STREAM_COALESCE_WAIT = 0.02
+    STREAM_COALESCE_MAX_CHARS = 128
+
+    # generate tasks watched by the shared countdown thread, see countdown_and_close
+    COUNTDOWN_PING_INTERVAL = 10
+    _countdown_tasks = []
+    _countdown_lock = threading.Lock()
+    _countdown_thread = None
 
     @classmethod
     def completion(cls, app_model: App, user: Union[Account, EndUser], args: Any,
@@ -172,8 +183,7 @@ class CompletionService:
         generate_worker_thread.start()
 
         # wait for 10 minutes to close the thread
-        cls.countdown_and_close(current_app._get_current_object(), generate_worker_thread, pubsub, user,
-                                generate_task_id)
+        cls.countdown_and_close(generate_worker_thread, pubsub, user, generate_task_id)
 
         return cls.compact_response(pubsub, streaming)
 
@@ -237,37 +247,62 @@ class CompletionService:
                 db.session.remove()
 
     @classmethod
-    def countdown_and_close(cls, flask_app: Flask, worker_thread, pubsub, detached_user,
-                            generate_task_id) -> threading.Thread:
+    def countdown_and_close(cls, worker_thread: threading.Thread, pubsub: PubSub,
+                            user: Union[Account, EndUser], generate_task_id: str):
         # wait for 10 minutes to close the thread
         timeout = 600
 
-        def close_pubsub():
-            with flask_app.app_context():
-                try:
-                    user = db.session.merge(detached_user)
-
-                    sleep_iterations = 0
-                    while sleep_iterations < timeout and worker_thread.is_alive():
-                        if sleep_iterations > 0 and sleep_iterations % 10 == 0:
-                            PubHandler.ping(user, generate_task_id)
-
-                        time.sleep(1)
-                        sleep_iterations += 1
-
-                    if worker_thread.is_alive():
-                        PubHandler.stop(user, generate_task_id)
-                        try:
-                            pubsub.close()
-                        except Exception:
-                            pass
-                finally:
-                    db.session.remove()
+        # resolve the redis keys now, the shared countdown thread runs without the request's db session
+        countdown_task = {
+            'worker_thread': worker_thread,
+            'pubsub': pubsub,
+            'channel': PubHandler.generate_channel_name(user, generate_task_id),
+            'stopped_cache_key': PubHandler.generate_stopped_cache_key(user, generate_task_id),
+            'deadline': time.monotonic() + timeout
+        }
 
-        countdown_thread = threading.Thread(target=close_pubsub)
-        countdown_thread.start()
+        with cls._countdown_lock:
+            cls._countdown_tasks.append(countdown_task)
 
-        return countdown_thread
+            if cls._countdown_thread is None or not cls._countdown_thread.is_alive():
+                cls._countdown_thread = threading.Thread(target=cls.countdown_worker, daemon=True)
+                cls._countdown_thread.start()
+
+    @classmethod
+    def countdown_worker(cls):
+        # a single thread pings every live generate task and closes the ones that outlive their deadline
+        while True:
+            time.sleep(cls.COUNTDOWN_PING_INTERVAL)
+
+            try:
+                cls.countdown_tick()
+            except Exception:
+                logging.exception("Failed to run generate task countdown")
+
+    @classmethod
+    def countdown_tick(cls):
+        now = time.monotonic()
+        with cls._countdown_lock:
+            countdown_tasks = cls._countdown_tasks
+            cls._countdown_tasks = [task for task in countdown_tasks
+                                    if task['worker_thread'].is_alive() and task['deadline'] > now]
+
+        for task in countdown_tasks:
+            if not task['worker_thread'].is_alive():
+                continue
+
+            try:
+                if task['deadline'] > now:
+                    PubHandler.ping(task['channel'])
+                    continue
+
+                PubHandler.stop_by_cache_key(task['stopped_cache_key'])
+                try:
+                    task['pubsub'].close()
+                except Exception:
+                    pass
+            except Exception:
+                logging.exception("Failed to ping or close generate task {}".format(task['channel']))
 
     @classmethod
     def generate_more_like_this(cls, app_model: App, user: Union[Account, EndUser],
@@ -332,8 +367,7 @@ class CompletionService:
         generate_worker_thread.start()
 
         # wait for 10 minutes to close the thread
-        cls.countdown_and_close(current_app._get_current_object(), generate_worker_thread, pubsub, user,
-                                generate_task_id)
+        cls.countdown_and_close(generate_worker_thread, pubsub, user, generate_task_id)
 
         return cls.compact_response(pubsub, streaming)
 
@@ -383,8 +417,7 @@ class CompletionService:
                 message_result = {}
                 for message in pubsub.listen():
                     if message["type"] == "message":
-                        result = message["data"].decode('utf-8')
-                        result = json.loads(result)
+                        result = json_loads_bytes(message["data"])
                         if result.get('error'):
                             cls.handle_error(result)
                         if result['event'] == 'annotation' and 'data' in result:
@@ -392,6 +425,7 @@ class CompletionService:
                             return cls.get_blocking_annotation_message_response_data(message_result)
                         if result['event'] == 'message' and 'data' in result:
                             message_result['message'] = result.get('data')
+                            message_result['answer'] = result.get('text')
                         if result['event'] == 'message_end' and 'data' in result:
                             message_result['message_end'] = result.get('data')
                             return cls.get_blocking_message_response_data(message_result)
@@ -410,38 +444,37 @@ class CompletionService:
                     pass
         else:
             def generate() -> Generator:
+                response_data_builders = cls.get_stream_response_data_builders()
+                message_response_prefix = None
+                dumps = json_dumps_bytes
+
                 try:
-                    for message in pubsub.listen():
-                        if message["type"] == "message":
-                            result = message["data"].decode('utf-8')
-                            result = json.loads(result)
-                            if result.get('error'):
-                                cls.handle_error(result)
-
-                            event = result.get('event')
-                            if event == "end":
-                                logging.debug("{} finished".format(generate_channel))
-                                break
-                            if event == 'message':
-                                yield "data: " + json.dumps(cls.get_message_response_data(result.get('data'))) + "\n\n"
-                            elif event == 'message_replace':
-                                yield "data: " + json.dumps(
-                                    cls.get_message_replace_response_data(result.get('data'))) + "\n\n"
-                            elif event == 'chain':
-                                yield "data: " + json.dumps(cls.get_chain_response_data(result.get('data'))) + "\n\n"
-                            elif event == 'agent_thought':
-                                yield "data: " + json.dumps(
-                                    cls.get_agent_thought_response_data(result.get('data'))) + "\n\n"
-                            elif event == 'annotation':
-                                yield "data: " + json.dumps(
-                                    cls.get_annotation_response_data(result.get('data'))) + "\n\n"
-                            elif event == 'message_end':
-                                yield "data: " + json.dumps(
-                                    cls.get_message_end_data(result.get('data'))) + "\n\n"
-                            elif event == 'ping':
-                                yield "event: ping\n\n"
-                            else:
-                                yield "data: " + json.dumps(result) + "\n\n"
+                    for result in cls.listen_stream_events(pubsub):
+                        if result.get('error'):
+                            cls.handle_error(result)
+
+                        event = result.get('event')
+                        if event == "end":
+                            logging.debug("{} finished".format(generate_channel))
+                            break
+                        if event == 'ping':
+                            yield b"event: ping\n\n"
+                            continue
+                        if event == 'message':
+                            # only the answer and timestamp change between chunks, the rest is encoded once
+                            if message_response_prefix is None:
+                                message_response_prefix = cls.get_message_response_prefix(result.get('data'))
+
+                            yield (b"data: " + message_response_prefix
+                                   + b',"answer":' + dumps(result.get('text'))
+                                   + b',"created_at":' + b"%d" % int(time.time()) + b"}\n\n")
+                            continue
+
+                        response_data_builder = response_data_builders.get(event)
+                        if response_data_builder:
+                            yield b"data: " + dumps(response_data_builder(result.get('data'))) + b"\n\n"
+                        else:
+                            yield b"data: " + dumps(result) + b"\n\n"
                 except ValueError as e:
                     if e.args[0] != "I/O operation on closed file.":  # ignore this error
                         logging.exception(e)
@@ -457,19 +490,75 @@ class CompletionService:
             return generate()
 
     @classmethod
-    def get_message_response_data(cls, data: dict):
+    def listen_stream_events(cls, pubsub: PubSub) -> Generator:
+        # bound once, these are read for every chunk drained below
+        coalesce_wait = cls.STREAM_COALESCE_WAIT
+        coalesce_max_chars = cls.STREAM_COALESCE_MAX_CHARS
+        get_message = pubsub.get_message
+        monotonic = time.monotonic
+
+        for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+
+            result = json_loads_bytes(message["data"])
+            while result is not None:
+                if result.get('event') != 'message':
+                    yield result
+                    break
+
+                # drain the chunks that are already on their way instead of framing every token separately
+                texts = [result['text']]
+                texts_length = len(texts[0])
+                next_result = None
+                deadline = monotonic() + coalesce_wait
+                while texts_length < coalesce_max_chars:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+
+                    next_message = get_message(timeout=remaining)
+                    if next_message is None:
+                        break
+                    if next_message["type"] != "message":
+                        continue
+
+                    next_result = json_loads_bytes(next_message["data"])
+                    if next_result.get('event') != 'message':
+                        break
+
+                    texts.append(next_result['text'])
+                    texts_length += len(texts[-1])
+                    next_result = None
+
+                result['text'] = ''.join(texts)
+                yield result
+
+                result = next_result
+
+    @classmethod
+    def get_stream_response_data_builders(cls) -> dict:
+        return {
+            'message_replace': cls.get_message_replace_response_data,
+            'chain': cls.get_chain_response_data,
+            'agent_thought': cls.get_agent_thought_response_data,
+            'annotation': cls.get_annotation_response_data,
+            'message_end': cls.get_message_end_data
+        }
+
+    @classmethod
+    def get_message_response_prefix(cls, data: dict) -> bytes:
         response_data = {
             'event': 'message',
             'task_id': data.get('task_id'),
-            'id': data.get('message_id'),
-            'answer': data.get('text'),
-            'created_at': int(time.time())
+            'id': data.get('message_id')
         }
 
         if data.get('mode') == 'chat':
             response_data['conversation_id'] = data.get('conversation_id')
 
-        return response_data
+        # strip the closing brace so the per-chunk answer and created_at can be appended
+        return orjson.dumps(response_data)[:-1]
 
     @classmethod
     def get_message_replace_response_data(cls, data: dict):
@@ -493,7 +582,7 @@ class CompletionService:
             'event': 'message',
             'task_id': message.get('task_id'),
             'id': message.get('message_id'),
-            'answer': message.get('text'),
+            'answer': data.get('answer'),
             'metadata': {},
             'created_at': int(time.time())
         }
@@ -0,0 +1,42 @@
+import json
+from unittest.mock import MagicMock
+
+from core.conversation_message_task import PubHandler
+
+
+def make_pub_handler() -> PubHandler:
+    return PubHandler(
+        user=MagicMock(id='user'),
+        task_id='task',
+        message=MagicMock(id='message'),
+        conversation=MagicMock(id='conversation', mode='chat')
+    )
+
+
+def test_pub_text(mocker):
+    mock_publish = mocker.patch('core.conversation_message_task.redis_client.publish')
+
+    make_pub_handler().pub_text('Hello')
+
+    channel, content = mock_publish.call_args.args
+    assert channel == 'generate_result:end-user-user-task'
+    assert json.loads(content) == {
+        'event': 'message',
+        'text': 'Hello',
+        'data': {
+            'task_id': 'task',
+            'message_id': 'message',
+            'mode': 'chat',
+            'conversation_id': 'conversation'
+        }
+    }
+
+
+def test_pub_text_with_lone_surrogate(mocker):
+    mock_publish = mocker.patch('core.conversation_message_task.redis_client.publish')
+
+    # half of an emoji, as published when a provider splits the surrogate pair across two deltas
+    make_pub_handler().pub_text('\ud83d')
+
+    _, content = mock_publish.call_args.args
+    assert json.loads(content)['text'] == '\ud83d'
@@ -0,0 +1,74 @@
+import time
+from unittest.mock import MagicMock
+
+from services.completion_service import CompletionService
+
+
+def make_countdown_task(name: str, alive: bool, deadline_offset: float) -> dict:
+    worker_thread = MagicMock()
+    worker_thread.is_alive.return_value = alive
+
+    return {
+        'worker_thread': worker_thread,
+        'pubsub': MagicMock(),
+        'channel': f'generate_result:{name}',
+        'stopped_cache_key': f'generate_result_stopped:{name}',
+        'deadline': time.monotonic() + deadline_offset
+    }
+
+
+def test_countdown_tick(mocker):
+    live_task = make_countdown_task('live', alive=True, deadline_offset=300)
+    expired_task = make_countdown_task('expired', alive=True, deadline_offset=-1)
+    finished_task = make_countdown_task('finished', alive=False, deadline_offset=300)
+
+    mocker.patch.object(CompletionService, '_countdown_tasks', [live_task, expired_task, finished_task])
+    mock_ping = mocker.patch('core.conversation_message_task.PubHandler.ping')
+    mock_stop = mocker.patch('core.conversation_message_task.PubHandler.stop_by_cache_key')
+
+    CompletionService.countdown_tick()
+
+    # a live task is pinged and kept
+    mock_ping.assert_called_once_with('generate_result:live')
+    assert CompletionService._countdown_tasks == [live_task]
+
+    # a task past its deadline is stopped and its pubsub closed
+    mock_stop.assert_called_once_with('generate_result_stopped:expired')
+    expired_task['pubsub'].close.assert_called_once()
+
+    # a finished task is dropped without being pinged or stopped
+    finished_task['pubsub'].close.assert_not_called()
+
+
+def test_countdown_tick_continues_after_failed_ping(mocker):
+    first_task = make_countdown_task('first', alive=True, deadline_offset=300)
+    second_task = make_countdown_task('second', alive=True, deadline_offset=300)
+
+    mocker.patch.object(CompletionService, '_countdown_tasks', [first_task, second_task])
+    mock_ping = mocker.patch('core.conversation_message_task.PubHandler.ping',
+                             side_effect=[ConnectionError(), None])
+
+    CompletionService.countdown_tick()
+
+    assert mock_ping.call_count == 2
+    assert CompletionService._countdown_tasks == [first_task, second_task]
+
+
+def test_countdown_and_close_restarts_dead_thread(mocker):
+    dead_thread = MagicMock()
+    dead_thread.is_alive.return_value = False
+
+    mocker.patch.object(CompletionService, '_countdown_tasks', [])
+    mocker.patch.object(CompletionService, '_countdown_thread', dead_thread)
+    mocker.patch('core.conversation_message_task.PubHandler.generate_channel_name',
+                 return_value='generate_result:task')
+    mocker.patch('core.conversation_message_task.PubHandler.generate_stopped_cache_key',
+                 return_value='generate_result_stopped:task')
+    mock_thread_class = mocker.patch('services.completion_service.threading.Thread')
+
+    CompletionService.countdown_and_close(MagicMock(), MagicMock(), MagicMock(), 'task')
+
+    mock_thread_class.assert_called_once_with(target=CompletionService.countdown_worker, daemon=True)
+    mock_thread_class.return_value.start.assert_called_once()
+    assert CompletionService._countdown_thread is mock_thread_class.return_value
+    assert len(CompletionService._countdown_tasks) == 1
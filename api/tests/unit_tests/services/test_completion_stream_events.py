@@ -0,0 +1,97 @@
+from typing import List, Optional
+
+from libs.helper import json_dumps_bytes
+from services.completion_service import CompletionService
+
+
+class StubPubSub:
+    def __init__(self, events: List[dict]):
+        self.messages = [{'type': 'subscribe', 'data': 1}]
+        self.messages.extend({'type': 'message', 'data': json_dumps_bytes(event)} for event in events)
+        self.get_message_timeouts = []
+
+    def listen(self):
+        while self.messages:
+            yield self.messages.pop(0)
+
+    def get_message(self, timeout: float) -> Optional[dict]:
+        self.get_message_timeouts.append(timeout)
+        return self.messages.pop(0) if self.messages else None
+
+
+def message_event(text: str) -> dict:
+    return {'event': 'message', 'text': text, 'data': {'task_id': 'task'}}
+
+
+def test_listen_stream_events_merges_message_chunks():
+    pubsub = StubPubSub([message_event('Hel'), message_event('lo'), message_event('!')])
+
+    results = list(CompletionService.listen_stream_events(pubsub))
+
+    assert [result['text'] for result in results] == ['Hello!']
+    assert results[0]['data'] == {'task_id': 'task'}
+    assert all(0 < timeout <= CompletionService.STREAM_COALESCE_WAIT for timeout in pubsub.get_message_timeouts)
+
+
+def test_listen_stream_events_skips_subscribe_messages():
+    pubsub = StubPubSub([message_event('a'), message_event('b')])
+    # a subscribe confirmation arriving while chunks are being drained
+    pubsub.messages.insert(2, {'type': 'subscribe', 'data': 1})
+
+    results = list(CompletionService.listen_stream_events(pubsub))
+
+    assert [result['text'] for result in results] == ['ab']
+
+
+def test_listen_stream_events_keeps_order_around_other_events():
+    pubsub = StubPubSub([
+        message_event('a'),
+        message_event('b'),
+        {'event': 'message_end', 'data': {'task_id': 'task'}},
+        message_event('c'),
+        {'error': 'ValueError', 'description': 'error'},
+        message_event('d'),
+        {'event': 'end'}
+    ])
+
+    results = list(CompletionService.listen_stream_events(pubsub))
+
+    assert results == [
+        message_event('ab'),
+        {'event': 'message_end', 'data': {'task_id': 'task'}},
+        message_event('c'),
+        {'error': 'ValueError', 'description': 'error'},
+        message_event('d'),
+        {'event': 'end'}
+    ]
+
+
+def test_listen_stream_events_caps_merged_chars():
+    chunk = 'x' * 100
+    pubsub = StubPubSub([message_event(chunk), message_event(chunk), message_event(chunk)])
+
+    results = list(CompletionService.listen_stream_events(pubsub))
+
+    # draining stops once STREAM_COALESCE_MAX_CHARS (128) is reached
+    assert [result['text'] for result in results] == [chunk * 2, chunk]
+
+
+def test_listen_stream_events_stops_at_deadline(mocker):
+    mocker.patch('services.completion_service.time.monotonic',
+                 side_effect=[0.0, CompletionService.STREAM_COALESCE_WAIT] * 2)
+    pubsub = StubPubSub([message_event('a'), message_event('b')])
+
+    results = list(CompletionService.listen_stream_events(pubsub))
+
+    # nothing is drained once the coalescing window has passed
+    assert [result['text'] for result in results] == ['a', 'b']
+    assert pubsub.get_message_timeouts == []
+
+
+def test_listen_stream_events_with_lone_surrogates():
+    # an emoji split across two streamed deltas, each half is a lone surrogate
+    pubsub = StubPubSub([message_event('\ud83d'), message_event('\ude00')])
+
+    results = list(CompletionService.listen_stream_events(pubsub))
+
+    assert [result['text'] for result in results] == ['\ud83d\ude00']